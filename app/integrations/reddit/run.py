@@ -1,42 +1,72 @@
-import os
+from argparse import Namespace
 from typing import cast
 
-from dotenv import load_dotenv
 from praw import Reddit
+from rich.console import Console
 
-from app.parser import get_parsed_args
+from app.lib import fetch_one, format_unfinished_sources, get_http_session
+from app.where import compile_where, get_upper_bound
 
-from .utils import filter_subreddits, render_to_console
+from .utils import (
+    REDDIT_STATE_DIR,
+    REDDIT_WHERE_FIELDS,
+    get_subreddits_posts,
+    get_subscribed_subreddits,
+    render_to_console,
+)
 
-load_dotenv()
-ARGS = get_parsed_args()
 
-REDDIT_CLIENT_ID = os.getenv("REDDIT_CLIENT_ID")
-REDDIT_CLIENT_SECRET = os.getenv("REDDIT_CLIENT_SECRET")
-REDDIT_PASSWORD = os.getenv("REDDIT_PASSWORD")
-REDDIT_USERNAME = os.getenv("REDDIT_USERNAME")
-REDDIT_USER_AGENT = os.getenv("REDDIT_USER_AGENT")
-REDDIT_BASE_URL = "https://www.reddit.com"
-REDDIT_HOURS_AGO = cast(int, (os.getenv("REDDIT_HOURS_AGO")))
-
-
-def render_reddit_results():
+def render_reddit_results(
+    config: dict[str, str | None], parsed_args: Namespace, console: Console
+):
     # instantiate client
     reddit_client = Reddit(
-        client_id=REDDIT_CLIENT_ID,
-        client_secret=REDDIT_CLIENT_SECRET,
-        password=REDDIT_PASSWORD,
-        user_agent=REDDIT_USER_AGENT,
-        username=REDDIT_USERNAME,
+        client_id=config.get("REDDIT_CLIENT_ID"),
+        client_secret=config.get("REDDIT_CLIENT_SECRET"),
+        password=config.get("REDDIT_PASSWORD"),
+        user_agent=config.get("REDDIT_USER_AGENT"),
+        username=config.get("REDDIT_USERNAME"),
+        requestor_kwargs={"session": get_http_session("reddit")},
     )
 
     # setup render data
-    filtered_subreddits = filter_subreddits(
-        subreddits=reddit_client.user.subreddits(), parsed_args=ARGS
+    filtered_subreddits = fetch_one(
+        fetch_fn=lambda: get_subscribed_subreddits(
+            reddit_client=reddit_client,
+            token_key=f"reddit:{config.get('REDDIT_CLIENT_ID')}:{config.get('REDDIT_USERNAME')}",
+            parsed_args=parsed_args,
+        ),
+        deadline_at=parsed_args.deadline_at,
     )
-    hours_ago = int(ARGS.reddit_hours_ago or REDDIT_HOURS_AGO)
 
-    render_to_console(
+    if filtered_subreddits is None:
+        console.print(
+            f"[bold red]Reddit[/bold red] {format_unfinished_sources(['subscribed subreddits'])}"
+        )
+        return
+
+    hours_ago: float = int(
+        parsed_args.reddit_hours_ago or cast(int, config.get("REDDIT_HOURS_AGO"))
+    )
+    where = compile_where(parsed_args.reddit_where, REDDIT_WHERE_FIELDS)
+
+    # an `age_hours` bound shortens paging through the listings
+    max_age_hours = get_upper_bound(parsed_args.reddit_where, "age_hours")
+    if max_age_hours is not None:
+        hours_ago = min(hours_ago, max_age_hours)
+
+    subreddits_posts = get_subreddits_posts(
+        reddit_client=reddit_client,
         subreddits=filtered_subreddits,
         hours_ago=hours_ago,
+        where=where,
+        parsed_args=parsed_args,
+        state_path=REDDIT_STATE_DIR / f"{config.get('REDDIT_USERNAME')}.json",
+    )
+
+    render_to_console(
+        console=console,
+        subreddits_posts=subreddits_posts,
+        hours_ago=hours_ago,
+        _timezone=cast(str, config.get("_TIMEZONE")),
     )
@@ -1,22 +1,131 @@
+import json
 import os
+import time
 from argparse import Namespace
-from datetime import datetime, timedelta
-from typing import Iterator, Tuple, cast
-
-import pytz
-from dotenv import load_dotenv
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Iterator, Tuple, cast
+
+from praw import Reddit
 from praw.models.reddit.submission import Submission
 from praw.models.reddit.subreddit import Subreddit
+from prawcore.auth import ScriptAuthorizer
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.padding import Padding
 
-from app.lib import create_link
+from app.lib import (
+    CACHE_DIR,
+    create_link,
+    fetch_all,
+    fetch_one,
+    format_datetime,
+    format_unfinished_sources,
+    render_chunk_groups,
+    write_chunks,
+    write_json_atomic,
+)
+from app.token_cache import (
+    get_cached_token,
+    is_token_expiring,
+    save_token,
+    schedule_token_refresh,
+)
 
-load_dotenv()
-console = Console()
-_TIMEZONE = cast(str, os.getenv("_TIMEZONE"))
 REDDIT_BASE_URL = "https://www.reddit.com"
+REDDIT_STATE_DIR = CACHE_DIR / "reddit"
+EXCLUSIVE_THUMBNAIL_TAGS = ["nsfw", "spoiler"]
+ALLOWED_THUMBNAIL_POST_TYPES = ["image", "video", "gallery"]
+PADDING_VALUES = (0, 2, 0, 2)
+REDDIT_WHERE_FIELDS: dict[str, Callable[[dict], Any]] = {
+    "ups": lambda post: post["ups"],
+    "upvote_ratio": lambda post: post["upvote_ratio"],
+    "comments": lambda post: post["num_comments"],
+    "flair": lambda post: post["link_flair_text"],
+    "subreddit": lambda post: post["subreddit"],
+    "author": lambda post: post["author"],
+    "title": lambda post: post["title"],
+    "type": lambda post: get_post_type(post)[0],
+    "nsfw": lambda post: post["over_18"],
+    "age_hours": lambda post: (time.time() - post["created_utc"]) / 3600,
+}
+
+
+def get_expiration_attribute(authorizer: ScriptAuthorizer) -> str | None:
+    """Returns name of the private attribute prawcore keeps token expiry in or None if this prawcore version is unknown
+
+    prawcore < 2.4 keeps a `time.time()` timestamp in seconds, later versions a `time.monotonic_ns()` one.
+    """
+
+    names = type(authorizer).is_valid.__code__.co_names
+
+    for attribute in ("_expiration_timestamp_ns", "_expiration_timestamp"):
+        if attribute in names:
+            return attribute
+
+    return None
+
+
+def refresh_reddit_token(
+    authorizer: ScriptAuthorizer, token_key: str, expiration_attribute: str
+) -> dict:
+    """Returns token info of a newly requested access token, stored in the token cache"""
+
+    authorizer.refresh()
+
+    expires_at = getattr(authorizer, expiration_attribute)
+    if expiration_attribute == "_expiration_timestamp_ns":
+        expires_at = time.time() + (expires_at - time.monotonic_ns()) / 1e9
+
+    token_info = {
+        "access_token": authorizer.access_token,
+        "expires_at": expires_at,
+        "scope": sorted(authorizer.scopes or []),
+    }
+    save_token(token_key, token_info)
+
+    return token_info
+
+
+def authorize_client(reddit_client: Reddit, token_key: str) -> None:
+    """Provides the client with a cached or a newly requested access token, refreshed in the background until the run ends"""
+
+    # praw has no public way of passing a token to the password grant authorizer
+    authorized_core = reddit_client._authorized_core
+
+    # read only clients are never authorized
+    if authorized_core is None:
+        return
+
+    authorizer = authorized_core._authorizer
+    expiration_attribute = get_expiration_attribute(authorizer)
+
+    # unknown prawcore internals, praw requests and refreshes tokens by itself
+    if expiration_attribute is None:
+        return
+
+    token_info = get_cached_token(token_key)
+
+    if token_info and not is_token_expiring(token_info):
+        expires_at = token_info["expires_at"]
+        if expiration_attribute == "_expiration_timestamp_ns":
+            expires_at = time.monotonic_ns() + int((expires_at - time.time()) * 1e9)
+
+        authorizer.access_token = token_info["access_token"]
+        setattr(authorizer, expiration_attribute, expires_at)
+        authorizer.scopes = set(token_info["scope"])
+    else:
+        token_info = refresh_reddit_token(authorizer, token_key, expiration_attribute)
+
+    schedule_token_refresh(
+        refresh_fn=partial(
+            refresh_reddit_token, authorizer, token_key, expiration_attribute
+        ),
+        expires_at=token_info["expires_at"],
+    )
 
 
 def filter_subreddits(
@@ -35,7 +144,230 @@ def filter_subreddits(
     return list(subreddits)
 
 
-def format_post_count(posts: list[Submission]) -> str:
+def get_subscribed_subreddits(
+    reddit_client: Reddit, token_key: str, parsed_args: Namespace
+) -> list[Subreddit]:
+    """Returns a list of subscribed subreddits checked against `--reddit-include` and `--reddit-exclude` flags,
+    authorizing the client first"""
+
+    authorize_client(reddit_client=reddit_client, token_key=token_key)
+
+    return filter_subreddits(
+        subreddits=reddit_client.user.subreddits(), parsed_args=parsed_args
+    )
+
+
+def serialize_post(post: Submission) -> dict:
+    """Returns dict of post properties used for rendering"""
+
+    # optional properties are read from the fetched data, missing attributes make praw fetch the post again
+    post_data = vars(post)
+
+    return {
+        "name": post.name,
+        "post_hint": post_data.get("post_hint"),
+        "is_gallery": "is_gallery" in post_data,
+        "thumbnail": post.thumbnail,
+        "over_18": post.over_18,
+        "subreddit": post.subreddit.display_name,
+        "subreddit_name_prefixed": post.subreddit_name_prefixed,
+        "author": str(post.author),
+        "permalink": post.permalink,
+        "title": post.title,
+        "ups": post.ups,
+        "upvote_ratio": post.upvote_ratio,
+        "num_comments": post.num_comments,
+        "link_flair_text": post.link_flair_text,
+        "created_utc": post.created_utc,
+        "selftext": post.selftext,
+        "url_overridden_by_dest": post_data.get("url_overridden_by_dest"),
+    }
+
+
+def get_new_posts(
+    subreddit: Subreddit, time_ago: datetime, seen_post_names: set[str]
+) -> list[dict]:
+    """Returns list of serialized posts created after `time_ago` and after the newest seen post,
+    sorted by creation date in descending order"""
+
+    new_posts = []
+
+    # listing is sorted by creation date, so paging can stop at the first seen or old post
+    for post in subreddit.new():
+        if (
+            post.name in seen_post_names
+            or datetime.utcfromtimestamp(post.created_utc) <= time_ago
+        ):
+            break
+
+        new_posts.append(serialize_post(post))
+
+    return new_posts
+
+
+_seen_posts_lock = Lock()
+
+
+def _read_seen_posts_state(state_path: Path) -> dict[str, dict]:
+    """Returns map of subreddit names to their seen posts state or an empty map if the state file is missing,
+    corrupt or written by an earlier version"""
+
+    try:
+        state = json.loads(state_path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+    # state written by earlier versions is not kept per subreddit
+    if not all(isinstance(value, dict) for value in state.values()):
+        return {}
+
+    return state
+
+
+def load_seen_posts(
+    state_path: Path, time_ago: datetime
+) -> dict[str, dict[str, float]]:
+    """Returns map of subreddit names to maps of post fullnames seen in previous runs to their creation timestamps,
+    leaving out subreddits whose previous run did not cover all posts since `time_ago`
+    """
+
+    with _seen_posts_lock:
+        state = _read_seen_posts_state(state_path)
+
+    return {
+        display_name: subreddit_state["posts"]
+        for display_name, subreddit_state in state.items()
+        if datetime.fromisoformat(subreddit_state["since"]) <= time_ago
+    }
+
+
+def save_seen_posts(
+    state_path: Path,
+    time_ago: datetime,
+    subreddits_posts: list[Tuple[str, list[dict] | None]],
+) -> None:
+    """Stores post fullnames and creation timestamps of fully fetched subreddits for `--reddit-refresh`,
+    keeping previously stored subreddits that were not fetched"""
+
+    with _seen_posts_lock:
+        state = _read_seen_posts_state(state_path)
+
+        for display_name, posts in subreddits_posts:
+            if posts is None:
+                continue
+
+            state[display_name] = {
+                "since": time_ago.isoformat(),
+                "posts": {post["name"]: post["created_utc"] for post in posts},
+            }
+
+        write_json_atomic(state_path, state)
+
+
+def refresh_seen_posts(
+    reddit_client: Reddit, post_names: list[str], time_ago: datetime
+) -> dict[str, list[dict]]:
+    """Returns map of subreddit names to seen posts created after `time_ago` with refreshed scores"""
+
+    refreshed_posts: dict[str, list[dict]] = {}
+
+    if not post_names:
+        return refreshed_posts
+
+    # `info` looks up to 100 posts per request
+    for info_item in reddit_client.info(fullnames=post_names):
+        # seen post fullnames are all submissions
+        post = cast(Submission, info_item)
+
+        if datetime.utcfromtimestamp(post.created_utc) <= time_ago:
+            continue
+
+        serialized_post = serialize_post(post)
+        refreshed_posts.setdefault(serialized_post["subreddit"], []).append(
+            serialized_post
+        )
+
+    return refreshed_posts
+
+
+def get_subreddits_posts(
+    reddit_client: Reddit,
+    subreddits: list[Subreddit],
+    hours_ago: float,
+    where: Callable[[dict], bool],
+    parsed_args: Namespace,
+    state_path: Path,
+) -> list[Tuple[str, list[dict] | None]]:
+    """Returns list of tuples of subreddit name and posts matching `where` sorted by creation date in descending order,
+    posts are None for subreddits not fetched before `--deadline`"""
+
+    time_ago = datetime.utcnow() - timedelta(hours=hours_ago)
+
+    seen_posts = (
+        load_seen_posts(state_path, time_ago) if parsed_args.reddit_refresh else {}
+    )
+    seen_post_names = {
+        subreddit.display_name: set(seen_posts.get(subreddit.display_name, {}))
+        for subreddit in subreddits
+    }
+    # posts that got too old since they were seen are not looked up again
+    refreshed_post_names = [
+        name
+        for display_name in seen_post_names
+        for name, created_utc in seen_posts.get(display_name, {}).items()
+        if datetime.utcfromtimestamp(created_utc) > time_ago
+    ]
+    # without refreshed posts every subreddit is unfinished, as the deadline has been reached
+    refreshed_posts = (
+        fetch_one(
+            fetch_fn=lambda: refresh_seen_posts(
+                reddit_client=reddit_client,
+                post_names=refreshed_post_names,
+                time_ago=time_ago,
+            ),
+            deadline_at=parsed_args.deadline_at,
+        )
+        or {}
+    )
+
+    # a praw client is not thread safe, so subreddits are fetched one at a time
+    fetched_posts = dict(
+        fetch_all(
+            fetch_fn=lambda subreddit: get_new_posts(
+                subreddit=subreddit,
+                time_ago=time_ago,
+                seen_post_names=seen_post_names[subreddit.display_name],
+            ),
+            sources=subreddits,
+            deadline_at=parsed_args.deadline_at,
+            max_workers=1,
+        )
+    )
+
+    subreddits_posts: list[Tuple[str, list[dict] | None]] = []
+    for idx, subreddit in enumerate(subreddits):
+        if idx not in fetched_posts:
+            subreddits_posts.append((subreddit.display_name, None))
+            continue
+
+        posts = fetched_posts[idx] + refreshed_posts.get(subreddit.display_name, [])
+        subreddits_posts.append(
+            (
+                subreddit.display_name,
+                sorted(posts, key=lambda post: post["created_utc"], reverse=True),
+            )
+        )
+
+    # filtered out posts are stored too, their refreshed scores may match next time
+    save_seen_posts(state_path, time_ago, subreddits_posts)
+
+    return [
+        (display_name, None if posts is None else [p for p in posts if where(p)])
+        for display_name, posts in subreddits_posts
+    ]
+
+
+def format_post_count(posts: list[dict]) -> str:
     """Returns formatted post count"""
 
     post_count = len(posts)
@@ -63,73 +395,51 @@ def format_ratio(ratio: float) -> str:
 
 
 def get_post_type(
-    post: Submission,
+    post: dict,
 ) -> Tuple[str, str]:
     """Returns tuple of post type and emoji representation based on available post properties"""
 
-    if hasattr(post, "post_hint"):
-        post_hint = post.post_hint
+    post_hint = post["post_hint"]
 
-        if post_hint == "image":
-            return "image", f"🖼 "
+    if post_hint == "image":
+        return "image", f"🖼 "
 
-        if post_hint in ["hosted:video", "rich:video"]:
-            return "video", "🎥"
+    if post_hint in ["hosted:video", "rich:video"]:
+        return "video", "🎥"
 
-    if hasattr(post, "is_gallery"):
+    if post["is_gallery"]:
         return "gallery", "🌌"
 
     return "link", "🔗"
 
 
-def render_post(
-    post: Submission,
+def should_render_thumbnail(post: dict) -> bool:
+    """Returns whether post thumbnail should be rendered"""
+
+    post_type, _ = get_post_type(post)
+
+    return (
+        post_type in ALLOWED_THUMBNAIL_POST_TYPES
+        and post["thumbnail"] not in EXCLUSIVE_THUMBNAIL_TAGS
+    )
+
+
+def render_post_head(
+    console: Console,
+    post: dict,
     base_url: str,
-    _timezone: str,
 ) -> None:
-    """Renders individual post to console"""
+    """Renders post header, title and body to console"""
 
-    ## data setup
     post_type, post_hint_emoji = get_post_type(post)
 
-    exclusive_thumbnail_tags = ["nsfw", "spoiler"]
-    allowed_thumbnail_post_types = [
-        "image",
-        "video",
-        "gallery",
-    ]
-
-    should_render_thumbnail = (
-        post_type in allowed_thumbnail_post_types
-        and post.thumbnail not in exclusive_thumbnail_tags
-    )
-
-    subreddit_link = create_link(
-        href=f"{base_url}/{post.subreddit_name_prefixed}",
-        label=post.subreddit_name_prefixed,
-        style="green",
-    )
-    author_link = create_link(
-        href=f"{base_url}/user/{post.author}",
-        label=f"u/{post.author}",
-        style="green",
-    )
     header = f"[bold white]{post_hint_emoji} {post_type.capitalize()}[/bold white]"
     title_link = create_link(
-        href=base_url + post.permalink,
-        label=post.title,
+        href=base_url + post["permalink"],
+        label=post["title"],
         style="green",
     )
-    ups = f"[red]↑{post.ups}[/red]"
-    upvote_ratio = format_ratio(post.upvote_ratio)
-    comments = f"💬 {post.num_comments}"
-    flair = f"[white]{f' | [bold white]{post.link_flair_text}[/bold white]' if post.link_flair_text else ''}"
-    subreddit_info = f"| {author_link} in {subreddit_link}"
-    created_at = f"| [b]{datetime.fromtimestamp(post.created_utc, pytz.timezone(_timezone)).strftime('%b %-d %H:%M')}[/b] ({_timezone})"
-    selftext = post.selftext if len(post.selftext) else ""
-
-    ## render line by line
-    padding_values = (0, 2, 0, 2)
+    selftext = post["selftext"]
 
     # top border
     console.rule(
@@ -138,35 +448,73 @@ def render_post(
     )
 
     # title
-    console.print(Padding(title_link, padding_values))
+    console.print(Padding(title_link, PADDING_VALUES))
 
     # body
     if selftext:
-        console.print("", Padding(Markdown(selftext), padding_values), "")
+        console.print("", Padding(Markdown(selftext), PADDING_VALUES), "")
+
+
+def render_post_thumbnail(console: Console, post: dict) -> None:
+    """Renders post thumbnail to terminal"""
+
+    if not (should_render_thumbnail(post) and console.is_terminal):
+        return
+
+    console.print()
+    console.print(" " * 2, end="")
+    os.system(f"imgcat {post['thumbnail']}")
+    console.print("", end="")
+
+
+def render_post_tail(
+    console: Console,
+    post: dict,
+    base_url: str,
+    _timezone: str,
+) -> None:
+    """Renders post source link and post info to console"""
 
-    # thumbnail
-    if should_render_thumbnail:
-        console.print()
-        console.print(" " * 2, end="")
-        os.system(f"imgcat {post.thumbnail}")
-        console.print("", end="")
+    subreddit_link = create_link(
+        href=f"{base_url}/{post['subreddit_name_prefixed']}",
+        label=post["subreddit_name_prefixed"],
+        style="green",
+    )
+    author_link = create_link(
+        href=f"{base_url}/user/{post['author']}",
+        label=f"u/{post['author']}",
+        style="green",
+    )
+    ups = f"[red]↑{post['ups']}[/red]"
+    upvote_ratio = format_ratio(post["upvote_ratio"])
+    comments = f"💬 {post['num_comments']}"
+    flair_text = post["link_flair_text"]
+    flair = (
+        f"[white]{f' | [bold white]{flair_text}[/bold white]' if flair_text else ''}"
+    )
+    subreddit_info = f"| {author_link} in {subreddit_link}"
+    created_at = format_datetime(
+        datetime.fromtimestamp(post["created_utc"], timezone.utc),
+        _timezone,
+        "%b %-d %H:%M",
+    )
 
     # View source
-    if hasattr(post, "url_overridden_by_dest"):
+    if post["url_overridden_by_dest"]:
         post_tag = (
-            f" [white on red] {post.thumbnail} [/white on red]"
-            if post.thumbnail in exclusive_thumbnail_tags
+            f" [white on red] {post['thumbnail']} [/white on red]"
+            if post["thumbnail"] in EXCLUSIVE_THUMBNAIL_TAGS
             else ""
         )
         view_source_link = create_link(
-            href=post.url_overridden_by_dest,
+            href=post["url_overridden_by_dest"],
             label=f"View source{post_tag}",
             style="bold blue",
         )
         console.print(
             Padding(
                 view_source_link,
-                padding_values,
+                PADDING_VALUES,
             ),
             "",  # nl
         )
@@ -174,8 +522,8 @@ def render_post(
     # post info
     console.print(
         Padding(
-            f"{ups}  {upvote_ratio}  {comments} {flair} {subreddit_info} {created_at}",
-            padding_values,
+            f"{ups}  {upvote_ratio}  {comments} {flair} {subreddit_info} | [b]{created_at}[/b] ({_timezone})",
+            PADDING_VALUES,
         )
     )
 
@@ -184,38 +532,44 @@ def render_post(
 
 
 def render_to_console(
-    subreddits: list[Subreddit],
-    hours_ago: int,
+    console: Console,
+    subreddits_posts: list[Tuple[str, list[dict] | None]],
+    hours_ago: float,
+    _timezone: str,
 ) -> None:
-    """Renders processed data to console"""
-
-    time_ago = datetime.utcnow() - timedelta(hours=hours_ago)
+    """Renders processed data to console, subreddits not fetched before `--deadline` are marked as such"""
 
     console.print(
         f"[bold red]Reddit[/bold red] Showing posts since [bold]{hours_ago}h[/bold] ago 👇",
         end="",
     )
 
-    for subreddit in subreddits:
-        new_posts = subreddit.new()
-        filtered_new_posts = [
-            p for p in new_posts if datetime.utcfromtimestamp(p.created_utc) > time_ago
-        ]
+    # pre-render all posts at once, thumbnails are rendered in between by `imgcat`
+    all_posts = [post for _, posts in subreddits_posts for post in posts or []]
+    chunk_groups = render_chunk_groups(
+        console,
+        [
+            partial(render_post_head, base_url=REDDIT_BASE_URL),
+            partial(render_post_tail, base_url=REDDIT_BASE_URL, _timezone=_timezone),
+        ],
+        all_posts,
+    )
+    rendered_posts = zip(all_posts, chunk_groups)
+
+    for display_name, posts in subreddits_posts:
+        if posts is None:
+            console.print(
+                f"\n[black on white] r/{display_name} [/black on white] {format_unfinished_sources([f'r/{display_name}'])}"
+            )
+            continue
 
-        post_count_text = format_post_count(filtered_new_posts)
+        post_count_text = format_post_count(posts)
 
         console.print(
-            f"\n[black on white] r/{subreddit.display_name} [/black on white] [green]{post_count_text}[/green]"
+            f"\n[black on white] r/{display_name} [/black on white] [green]{post_count_text}[/green]"
         )
 
-        if filtered_new_posts:
-            for post in sorted(
-                filtered_new_posts,
-                key=lambda post: post.created_utc,
-                reverse=True,
-            ):
-                render_post(
-                    post=post,
-                    base_url=REDDIT_BASE_URL,
-                    _timezone=_TIMEZONE,
-                )
+        for post, (head, tail) in islice(rendered_posts, len(posts)):
+            write_chunks(console, [head])
+            render_post_thumbnail(console, post)
+            write_chunks(console, [tail])
@@ -1,26 +1,21 @@
-import os
+from argparse import Namespace
 from typing import cast
 
-from dotenv import load_dotenv
+from rich.console import Console
 from spotipy import Spotify
 from spotipy.oauth2 import SpotifyOAuth
 
-from app.parser import get_parsed_args
+from app.lib import get_http_session
+from app.where import compile_where, get_upper_bound
 
 from .utils import (
-    get_current_user_followed_artists,
+    SPOTIFY_WHERE_FIELDS,
+    TokenCacheHandler,
     get_current_user_followed_artists_songs,
+    get_followed_artists,
     render_to_console,
 )
 
-load_dotenv()
-ARGS = get_parsed_args()
-
-SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
-SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
-SPOTIFY_REDIRECT_URI = os.getenv("SPOTIFY_REDIRECT_URI")
-SPOTIFY_DAYS_AGO = cast(int, os.getenv("SPOTIFY_DAYS_AGO"))
-
 SCOPES = [
     "user-follow-read",
     "user-read-playback-state",
@@ -33,26 +28,58 @@ SCOPES = [
 ]
 
 
-def render_spotify_results():
+def render_spotify_results(
+    config: dict[str, str | None], parsed_args: Namespace, console: Console
+):
     # instantiate client
-    spotify_client = Spotify(
-        auth_manager=SpotifyOAuth(
-            client_id=SPOTIFY_CLIENT_ID,
-            client_secret=SPOTIFY_CLIENT_SECRET,
-            redirect_uri=SPOTIFY_REDIRECT_URI,
-            scope=SCOPES,
-        )
+    http_session = get_http_session("spotify")
+    # the user is only known after authorization, so tokens are cached per profile
+    auth_manager = SpotifyOAuth(
+        client_id=config.get("SPOTIFY_CLIENT_ID"),
+        client_secret=config.get("SPOTIFY_CLIENT_SECRET"),
+        redirect_uri=config.get("SPOTIFY_REDIRECT_URI"),
+        scope=SCOPES,
+        cache_handler=TokenCacheHandler(
+            token_key=f"spotify:{config.get('SPOTIFY_CLIENT_ID')}:{config.get('PROFILE') or 'default'}"
+        ),
+        requests_session=http_session,
     )
+    spotify_client = Spotify(auth_manager=auth_manager, requests_session=http_session)
 
     # setup render data
-    followed_artists_list = get_current_user_followed_artists(
-        client=spotify_client, limit=50, _range=500
+    followed_artists_list = get_followed_artists(
+        client=spotify_client, deadline_at=parsed_args.deadline_at
+    )
+
+    if followed_artists_list is None:
+        render_to_console(
+            console=console, track_list=[], unfinished_artist_names=["followed artists"]
+        )
+        return
+
+    days_ago: float = int(
+        parsed_args.spotify_days_ago or cast(int, config.get("SPOTIFY_DAYS_AGO"))
     )
-    days_ago = int(ARGS.spotify_days_ago or SPOTIFY_DAYS_AGO)
-    followed_artists_track_list = get_current_user_followed_artists_songs(
+
+    # an `age_days` bound narrows the release years searched for
+    max_age_days = get_upper_bound(parsed_args.spotify_where, "age_days")
+    if max_age_days is not None:
+        days_ago = min(days_ago, max_age_days)
+
+    (
+        followed_artists_track_list,
+        unfinished_artist_names,
+    ) = get_current_user_followed_artists_songs(
+        console=console,
         client=spotify_client,
         followed_artists=followed_artists_list,
         days_ago=days_ago,
+        where=compile_where(parsed_args.spotify_where, SPOTIFY_WHERE_FIELDS),
+        deadline_at=parsed_args.deadline_at,
     )
 
-    render_to_console(followed_artists_track_list)
+    render_to_console(
+        console=console,
+        track_list=followed_artists_track_list,
+        unfinished_artist_names=unfinished_artist_names,
+    )
@@ -1,13 +1,83 @@
+from bisect import insort
 from datetime import datetime, timedelta
+from functools import partial
 from textwrap import dedent
+from typing import Any, Callable, Tuple
 
 from rich.console import Console
 from rich.progress import track as rich_track
 from spotipy import Spotify
+from spotipy.cache_handler import CacheFileHandler, CacheHandler
+from spotipy.oauth2 import SpotifyOAuth
 
-from app.lib import create_link
+from app.lib import (
+    create_link,
+    fetch_all,
+    fetch_one,
+    format_unfinished_sources,
+    render_chunks,
+    write_chunks,
+)
+from app.token_cache import get_cached_token, save_token, schedule_token_refresh
 
-console = Console()
+SPOTIFY_WHERE_FIELDS: dict[str, Callable[[dict], Any]] = {
+    "name": lambda track: track["name"],
+    "artists": lambda track: [artist["name"] for artist in track["artists"]],
+    "duration_seconds": lambda track: track["duration_ms"] / 1000,
+    "age_days": lambda track: (datetime.utcnow() - track["release_date"]).days,
+}
+
+
+class TokenCacheHandler(CacheHandler):
+    """Spotify cache handler backed by the shared token cache"""
+
+    def __init__(self, token_key: str):
+        """Stores tokens in the shared token cache under `token_key`"""
+        self.token_key = token_key
+
+    def get_cached_token(self) -> dict | None:
+        """Returns token info from the shared token cache, migrating the spotipy `.cache` file token if missing"""
+
+        token_info = get_cached_token(self.token_key)
+
+        # tokens of earlier versions were cached by spotipy in `.cache`, reusing them saves a new authorization flow
+        if token_info is None:
+            token_info = CacheFileHandler().get_cached_token()
+
+            if token_info is not None:
+                save_token(self.token_key, token_info)
+
+        return token_info
+
+    def save_token_to_cache(self, token_info: dict) -> None:
+        """Stores token info in the shared token cache"""
+        save_token(self.token_key, token_info)
+
+
+def refresh_spotify_token(auth_manager: SpotifyOAuth) -> dict:
+    """Returns token info of a newly requested access token, stored in the token cache by `auth_manager`"""
+
+    token_info = auth_manager.cache_handler.get_cached_token()
+
+    return auth_manager.refresh_access_token(token_info["refresh_token"])
+
+
+def authorize_client(auth_manager: SpotifyOAuth) -> None:
+    """Validates cached access token of the auth manager and keeps it refreshed in the background until the run ends"""
+
+    token_info = auth_manager.validate_token(
+        auth_manager.cache_handler.get_cached_token()
+    )
+
+    # without a cached token the authorization flow is run right away, so the new token is refreshed as well
+    if not token_info:
+        auth_manager.get_access_token(as_dict=False)
+        token_info = auth_manager.cache_handler.get_cached_token()
+
+    schedule_token_refresh(
+        refresh_fn=partial(refresh_spotify_token, auth_manager),
+        expires_at=token_info["expires_at"],
+    )
 
 
 def get_current_user_followed_artists(
@@ -35,6 +105,20 @@ def get_current_user_followed_artists(
     return current_user_followed_artists
 
 
+def get_followed_artists(
+    client: Spotify, deadline_at: float | None
+) -> list[dict] | None:
+    """Returns a list of current user followed artists, authorizing the client first, or None if `deadline_at` is reached first"""
+
+    def fetch() -> list[dict]:
+        """Returns a list of current user followed artists, authorizing the client first"""
+
+        authorize_client(client.auth_manager)
+        return get_current_user_followed_artists(client=client, limit=50, _range=500)
+
+    return fetch_one(fetch_fn=fetch, deadline_at=deadline_at)
+
+
 def get_date_token(release_date_precision: str, parse: bool) -> str:
     """Returns date token based on the release date precision"""
 
@@ -54,24 +138,62 @@ def get_date_token(release_date_precision: str, parse: bool) -> str:
     return ""
 
 
-def get_current_user_followed_artists_songs(
-    client: Spotify, followed_artists: list[dict], days_ago: int
+def search_artist_tracks(
+    client: Spotify, artist: dict, time_ago: datetime
 ) -> list[dict]:
-    """Returns list of track dicts sorted by release date in descending order"""
+    """Returns list of track search results of the artist released in the years since `time_ago`"""
+
+    query = f"artist:{artist['name']} year:{time_ago.year}-{datetime.utcnow().year}"
+
+    return client.search(type="track", q=query)["tracks"]["items"]
+
 
-    all_artists_tracks: list[dict] = []
+def get_current_user_followed_artists_songs(
+    console: Console,
+    client: Spotify,
+    followed_artists: list[dict],
+    days_ago: float,
+    where: Callable[[dict], bool],
+    deadline_at: float | None,
+) -> Tuple[list[dict], list[str]]:
+    """Returns tuple of track dicts matching `where` sorted by release date in descending order
+    and of artist names whose tracks were not fetched before `deadline_at`"""
+
+    time_ago = datetime.utcnow() - timedelta(days=days_ago)
+
+    # URLs of tracks seen so far in search results, whether or not they were filtered out
+    track_index: set[str] = set()
+    # kept sorted by release date in descending order as tracks are collected
+    sorted_tracks: list[dict] = []
+
+    searched_tracks = dict(
+        rich_track(
+            fetch_all(
+                fetch_fn=partial(search_artist_tracks, client, time_ago=time_ago),
+                sources=followed_artists,
+                deadline_at=deadline_at,
+            ),
+            total=len(followed_artists),
+            description=f"[bold green]Spotify[/bold green] Finding songs released since [bold]{days_ago}d[/bold] ago",
+            console=console,
+        )
+    )
 
-    for artist in rich_track(
-        followed_artists,
-        description=f"[bold green]Spotify[/bold green] Finding songs released since [bold]{days_ago}d[/bold] ago",
-    ):
+    unfinished_artist_names = []
+    for idx, artist in enumerate(followed_artists):
+        if idx not in searched_tracks:
+            unfinished_artist_names.append(artist["name"])
+            continue
+
+        for _track in searched_tracks[idx]:
+            track_url = _track["external_urls"]["spotify"]
+
+            # collaborations are found again for every followed artist on the track
+            if track_url in track_index:
+                continue
 
-        all_artist_tracks = client.search(type="track", q=f"artist:{artist['name']}")[
-            "tracks"
-        ]["items"]
+            track_index.add(track_url)
 
-        formatted_all_artist_tracks = []
-        for _track in all_artist_tracks:
             # need to convert release date from stamp
             release_date_str = _track["album"]["release_date"]
             release_date_precision = _track["album"]["release_date_precision"]
@@ -84,7 +206,7 @@ def get_current_user_followed_artists_songs(
             release_date = datetime.strptime(release_date_str, parse_token)
 
             # filter out tracks that have been released after the criteria
-            if not release_date > datetime.utcnow() - timedelta(days=days_ago):
+            if not release_date > time_ago:
                 continue
 
             # there can be several artist on a track
@@ -96,32 +218,26 @@ def get_current_user_followed_artists_songs(
                 for artist in _track["artists"]
             ]
 
-            # keep track of this because URLs can repeat
-            all_tracks_urls = [track["url"] for track in all_artists_tracks]
-
-            # append only if the same URL is not present already
-            if _track["external_urls"]["spotify"] not in all_tracks_urls:
-
-                formatted_all_artist_tracks.append(
-                    {
-                        "name": _track["name"],
-                        "url": _track["external_urls"]["spotify"],
-                        "artists": artists_list,
-                        "release_date": release_date,
-                        "release_date_precision": _track["album"][
-                            "release_date_precision"
-                        ],
-                        "duration_ms": _track["duration_ms"],
-                    },
-                )
-
-        all_artists_tracks += formatted_all_artist_tracks
-
-    return sorted(
-        all_artists_tracks,
-        key=lambda track: track["release_date"],
-        reverse=True,
-    )
+            formatted_track = {
+                "name": _track["name"],
+                "url": track_url,
+                "artists": artists_list,
+                "release_date": release_date,
+                "release_date_precision": release_date_precision,
+                "duration_ms": _track["duration_ms"],
+            }
+
+            if not where(formatted_track):
+                continue
+
+            # inserted after tracks with the same release date, same as a stable sort
+            insort(
+                sorted_tracks,
+                formatted_track,
+                key=lambda track: -track["release_date"].toordinal(),
+            )
+
+    return sorted_tracks, unfinished_artist_names
 
 
 def format_artists(artists_list: list[dict], delimiter: str) -> str:
@@ -155,8 +271,22 @@ def format_track(track: dict) -> str:
     return dedent(f"{title_link}" f"{duration}" f" by {artists}" f" on {release_date}")
 
 
-def render_to_console(track_list: list[dict]) -> None:
+def render_track(console: Console, item: tuple[int, dict]) -> None:
+    """Renders individual numbered track to console"""
+
+    idx, track = item
+    console.print(f"{str(idx)}. {format_track(track)}")
+
+
+def render_to_console(
+    console: Console, track_list: list[dict], unfinished_artist_names: list[str]
+) -> None:
     """Renders processed data to console"""
 
-    for idx, track in enumerate(track_list):
-        console.print(f"{str(idx+1)}. {format_track(track)}")
+    if unfinished_artist_names:
+        console.print(format_unfinished_sources(unfinished_artist_names))
+
+    write_chunks(
+        console,
+        render_chunks(console, render_track, list(enumerate(track_list, start=1))),
+    )
@@ -1,35 +1,48 @@
-import os
-from app.parser import get_parsed_args
+from argparse import Namespace
 from typing import cast
 
-from dotenv import load_dotenv
+from rich.console import Console
 from tweepy import Client
 
-from .utils import get_all_tweets, render_to_console
+from app.lib import get_http_session
+from app.where import compile_where, get_upper_bound
 
-load_dotenv()
-ARGS = get_parsed_args()
+from .utils import TWITTER_WHERE_FIELDS, get_all_tweets, render_to_console
 
-TWITTER_API_KEY = os.getenv("TWITTER_API_KEY")
-TWITTER_API_KEY_SECRET = os.getenv("TWITTER_API_KEY_SECRET")
-TWITTER_ACCESS_TOKEN = os.getenv("TWITTER_ACCESS_TOKEN")
-TWITTER_ACCESS_TOKEN_SECRET = os.getenv("TWITTER_ACCESS_TOKEN_SECRET")
-TWITTER_HOURS_AGO = cast(int, (os.getenv("TWITTER_HOURS_AGO")))
 
-
-def render_twitter_results():
+def render_twitter_results(
+    config: dict[str, str | None], parsed_args: Namespace, console: Console
+):
     # instantiate client
     twitter_client = Client(
-        consumer_key=TWITTER_API_KEY,
-        consumer_secret=TWITTER_API_KEY_SECRET,
-        access_token=TWITTER_ACCESS_TOKEN,
-        access_token_secret=TWITTER_ACCESS_TOKEN_SECRET,
+        consumer_key=config.get("TWITTER_API_KEY"),
+        consumer_secret=config.get("TWITTER_API_KEY_SECRET"),
+        access_token=config.get("TWITTER_ACCESS_TOKEN"),
+        access_token_secret=config.get("TWITTER_ACCESS_TOKEN_SECRET"),
     )
+    twitter_client.session = get_http_session("twitter")
 
     # setup render data
-    hours_ago = int(ARGS.twitter_hours_ago or TWITTER_HOURS_AGO)
-    all_tweets = get_all_tweets(
-        client=twitter_client, parsed_args=ARGS, hours_ago=hours_ago
+    hours_ago: float = int(
+        parsed_args.twitter_hours_ago or cast(int, config.get("TWITTER_HOURS_AGO"))
+    )
+
+    # an `age_hours` bound narrows the requested time range
+    max_age_hours = get_upper_bound(parsed_args.twitter_where, "age_hours")
+    if max_age_hours is not None:
+        hours_ago = min(hours_ago, max_age_hours)
+
+    all_tweets, unfinished_usernames = get_all_tweets(
+        console=console,
+        client=twitter_client,
+        parsed_args=parsed_args,
+        hours_ago=hours_ago,
+        where=compile_where(parsed_args.twitter_where, TWITTER_WHERE_FIELDS),
     )
 
-    render_to_console(all_tweets)
+    render_to_console(
+        console=console,
+        all_tweets=all_tweets,
+        unfinished_usernames=unfinished_usernames,
+        _timezone=cast(str, config.get("_TIMEZONE")),
+    )
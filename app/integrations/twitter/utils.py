@@ -1,11 +1,10 @@
-import os
+import time
 from argparse import Namespace
 from datetime import datetime, timedelta
+from functools import partial
 from textwrap import dedent
-from typing import Tuple, cast
+from typing import Any, Callable, Tuple
 
-import pytz
-from dotenv import load_dotenv
 from rich.console import Console
 from rich.panel import Panel
 from rich.progress import track as rich_track
@@ -14,11 +13,32 @@ from tweepy.client import Response
 from tweepy.tweet import Tweet
 from tweepy.user import User
 
-from app.lib import create_link
-
-load_dotenv()
-console = Console()
-_TIMEZONE = cast(str, os.getenv("_TIMEZONE"))
+from app.lib import (
+    create_link,
+    fetch_all,
+    fetch_one,
+    format_datetime,
+    format_unfinished_sources,
+    render_chunks,
+    write_chunks,
+)
+from app.where import get_bool_pushdown, references_field
+
+# the API rejects a `start_time` that is not at least this many seconds in the past
+TWITTER_MIN_WINDOW_SECONDS = 10
+TWITTER_WHERE_FIELDS: dict[str, Callable[[dict], Any]] = {
+    "likes": lambda item: item["metrics"]["like_count"],
+    "retweets": lambda item: item["metrics"]["retweet_count"],
+    "replies": lambda item: item["metrics"]["reply_count"],
+    "quotes": lambda item: item["metrics"]["quote_count"],
+    "retweet": lambda item: get_tweet_type(item["tweet"])[0] == "retweet",
+    "reply": lambda item: get_tweet_type(item["tweet"])[0] == "reply",
+    "text": lambda item: item["tweet"]["text"],
+    "username": lambda item: item["user"]["username"],
+    "name": lambda item: item["user"]["name"],
+    "age_hours": lambda item: (time.time() - item["tweet"]["created_at"].timestamp())
+    / 3600,
+}
 
 
 def get_current_user_following(client: Client, parsed_args: Namespace) -> list[User]:
@@ -40,62 +60,120 @@ def get_current_user_following(client: Client, parsed_args: Namespace) -> list[U
 
 
 def get_excluded_tweet_types(exclude_list: list, parsed_args: Namespace) -> list | None:
-    """Returns a list of excluded tweet types or None if no args are passed in"""
+    """Returns a list of excluded tweet types or None if no args are passed in
+
+    Tweet types used by `--twitter-where` are included, unless the expression requires them to be excluded.
+    """
 
-    include_retweets_arg = parsed_args.twitter_retweets
-    include_replies_arg = parsed_args.twitter_replies
+    where_tree = parsed_args.twitter_where
 
-    if include_replies_arg:
-        exclude_list.remove("replies")
+    for tweet_type, where_field, include_arg in [
+        ("replies", "reply", parsed_args.twitter_replies),
+        ("retweets", "retweet", parsed_args.twitter_retweets),
+    ]:
+        if get_bool_pushdown(where_tree, where_field) is False:
+            continue
 
-    if include_retweets_arg:
-        exclude_list.remove("retweets")
+        if include_arg or references_field(where_tree, where_field):
+            exclude_list.remove(tweet_type)
 
     return exclude_list if exclude_list else None
 
 
+def get_user_tweets(
+    client: Client,
+    user: User,
+    time_ago: datetime,
+    excluded_tweet_types: list | None,
+) -> Response:
+    """Returns tweets(response object) of the user created after `time_ago`"""
+
+    return client.get_users_tweets(
+        id=user.data["id"],
+        start_time=time_ago,
+        tweet_fields=[
+            "created_at",
+            "public_metrics",
+            "author_id",
+        ],
+        user_fields=["name", "username", "url"],
+        expansions=["author_id"],
+        exclude=excluded_tweet_types,
+        user_auth=True,
+    )
+
+
 def get_all_tweets(
-    client: Client, parsed_args: Namespace, hours_ago: int
-) -> list[Response]:
-    """Return all tweets(response objects) from followed users checked against `excluded_tweet_types` and `hours_ago`"""
+    console: Console,
+    client: Client,
+    parsed_args: Namespace,
+    hours_ago: float,
+    where: Callable[[dict], bool],
+) -> Tuple[list[dict], list[str]]:
+    """Return tuple of all serialized tweets from followed users checked against `excluded_tweet_types`, `hours_ago` and `where`
+    and of usernames whose tweets were not fetched before `--deadline`"""
+
+    # e.g. an `age_hours < 0` filter, which no tweet matches
+    if hours_ago * 3600 < TWITTER_MIN_WINDOW_SECONDS:
+        return [], []
 
     time_ago = datetime.utcnow() - timedelta(hours=hours_ago)
-    following = get_current_user_following(client, parsed_args)
+    following = fetch_one(
+        fetch_fn=partial(get_current_user_following, client, parsed_args),
+        deadline_at=parsed_args.deadline_at,
+    )
+
+    if following is None:
+        return [], ["followed users"]
 
     excluded_tweet_types = get_excluded_tweet_types(
         exclude_list=["replies", "retweets"], parsed_args=parsed_args
     )
 
-    all_tweets = []
-    for followed in rich_track(
-        following,
-        description=f"[bold blue]Twitter[/bold blue] Finding tweets since [bold]{hours_ago}h[/bold] ago",
-    ):
-        followed_id = followed.data["id"]
-
-        tweets = client.get_users_tweets(
-            id=followed_id,
-            start_time=time_ago,
-            tweet_fields=[
-                "created_at",
-                "public_metrics",
-                "author_id",
-            ],
-            user_fields=["name", "username", "url"],
-            expansions=["author_id"],
-            exclude=excluded_tweet_types,
-            user_auth=True,
+    fetched_tweets = dict(
+        rich_track(
+            fetch_all(
+                fetch_fn=partial(
+                    get_user_tweets,
+                    client,
+                    time_ago=time_ago,
+                    excluded_tweet_types=excluded_tweet_types,
+                ),
+                sources=following,
+                deadline_at=parsed_args.deadline_at,
+            ),
+            total=len(following),
+            description=f"[bold blue]Twitter[/bold blue] Finding tweets since [bold]{hours_ago}h[/bold] ago",
+            console=console,
         )
+    )
+
+    all_tweets = []
+    unfinished_usernames = []
+    for idx, followed in enumerate(following):
+        if idx not in fetched_tweets:
+            unfinished_usernames.append(f"@{followed.username}")
+            continue
+
+        tweets = fetched_tweets[idx]
 
         if not tweets.meta["result_count"]:
             continue
 
-        all_tweets.append(tweets)
+        users = {u["id"]: u for u in tweets.includes["users"]}
 
-    return all_tweets
+        for tweet in sorted(
+            tweets.data, key=lambda tweet: tweet["created_at"], reverse=True
+        ):
+            serialized_tweet = serialize_tweet(tweet, users[tweet.author_id])
+
+            if where(serialized_tweet):
+                all_tweets.append(serialized_tweet)
 
+    return all_tweets, unfinished_usernames
 
-def get_tweet_type(tweet: Tweet) -> Tuple[str, str]:
+
+def get_tweet_type(tweet: dict) -> Tuple[str, str]:
     """Returns tuple of tweet type and color representation based on the `tweet["text"]` contents"""
 
     if tweet["text"].startswith("@"):
@@ -107,7 +185,7 @@ def get_tweet_type(tweet: Tweet) -> Tuple[str, str]:
     return "tweet", "bold red"
 
 
-def format_tweet(tweet: Tweet, user: User, metrics: dict, _timezone: str) -> str:
+def format_tweet(tweet: dict, user: dict, metrics: dict, _timezone: str) -> str:
     """Returns formatted tweet representation"""
 
     name = f"[bold]{user['name']}[/bold]"
@@ -116,7 +194,7 @@ def format_tweet(tweet: Tweet, user: User, metrics: dict, _timezone: str) -> str
         label=f"@{user['username']}",
         style="white",
     )
-    created_at = f'{(tweet["created_at"].astimezone(pytz.timezone(_timezone))).strftime("%b %-d %H:%M")} ({_timezone})'
+    created_at = f'{format_datetime(tweet["created_at"], _timezone, "%b %-d %H:%M")} ({_timezone})'
     body = tweet["text"]
     replies = f"💬 {metrics['reply_count']}"
     retweets = f"🔃 {metrics['retweet_count']}"
@@ -137,32 +215,59 @@ def format_tweet(tweet: Tweet, user: User, metrics: dict, _timezone: str) -> str
     )
 
 
-def format_tweet_count(tweets: list[Response]) -> str:
+def format_tweet_count(tweets: list[dict]) -> str:
     """Returns formatted representation of tweet count"""
 
     if not len(tweets):
         return "[red bold]No tweets found.[/red bold]"
 
-    tweet_count = sum([t.meta["result_count"] for t in tweets])
+    tweet_count = len(tweets)
 
     return (
         f"[green]{tweet_count} new {'tweet' if tweet_count == 1 else 'tweets'}[/green]"
     )
 
 
-def render_to_console(all_tweets: list[Response]) -> None:
+def serialize_tweet(tweet: Tweet, user: User) -> dict:
+    """Returns dict of tweet and author properties used for rendering"""
+
+    return {
+        "tweet": {
+            "id": tweet["id"],
+            "text": tweet["text"],
+            "created_at": tweet["created_at"],
+        },
+        "user": {
+            "name": user["name"],
+            "username": user["username"],
+        },
+        "metrics": tweet["public_metrics"],
+    }
+
+
+def render_tweet(console: Console, item: dict, _timezone: str) -> None:
+    """Renders individual tweet to console"""
+
+    console.print(
+        Panel(format_tweet(item["tweet"], item["user"], item["metrics"], _timezone))
+    )
+
+
+def render_to_console(
+    console: Console,
+    all_tweets: list[dict],
+    unfinished_usernames: list[str],
+    _timezone: str,
+) -> None:
     """Renders processed data to console"""
 
     tweet_count_text = format_tweet_count(all_tweets)
     console.print(tweet_count_text)
 
-    for tweet_obj in all_tweets:
-        users = {u["id"]: u for u in tweet_obj.includes["users"]}
+    if unfinished_usernames:
+        console.print(format_unfinished_sources(unfinished_usernames))
 
-        for tweet in sorted(
-            tweet_obj.data, key=lambda tweet: tweet["created_at"], reverse=True
-        ):
-            user = users[tweet.author_id]
-            metrics = tweet["public_metrics"]
-
-            console.print(Panel(format_tweet(tweet, user, metrics, _TIMEZONE)))
+    write_chunks(
+        console,
+        render_chunks(console, partial(render_tweet, _timezone=_timezone), all_tweets),
+    )
@@ -1,4 +1,33 @@
+import ast
+import time
 from argparse import ArgumentParser, Namespace
+from pathlib import Path
+
+from app.where import parse_where
+
+
+def parse_reddit_where(expression: str) -> ast.Expression:
+    """Returns syntax tree of a `--reddit-where` filter expression"""
+
+    from app.integrations.reddit.utils import REDDIT_WHERE_FIELDS
+
+    return parse_where(expression, REDDIT_WHERE_FIELDS)
+
+
+def parse_spotify_where(expression: str) -> ast.Expression:
+    """Returns syntax tree of a `--spotify-where` filter expression"""
+
+    from app.integrations.spotify.utils import SPOTIFY_WHERE_FIELDS
+
+    return parse_where(expression, SPOTIFY_WHERE_FIELDS)
+
+
+def parse_twitter_where(expression: str) -> ast.Expression:
+    """Returns syntax tree of a `--twitter-where` filter expression"""
+
+    from app.integrations.twitter.utils import TWITTER_WHERE_FIELDS
+
+    return parse_where(expression, TWITTER_WHERE_FIELDS)
 
 
 def get_parsed_args() -> Namespace:
@@ -19,8 +48,25 @@ def get_parsed_args() -> Namespace:
         "--reddit-exclude", nargs="+", help="List of subreddits to exclude"
     )
 
+    parser.add_argument(
+        "--reddit-refresh",
+        action="store_true",
+        help="Refresh scores of posts seen in the previous run instead of fetching them again",
+    )
+
+    parser.add_argument(
+        "--reddit-where",
+        type=parse_reddit_where,
+        help="Filter expression over post fields, e.g. 'ups > 100 and flair != \"Meta\"'",
+    )
+
     # spotify
     parser.add_argument("--spotify-days-ago", type=int, help="Days since released")
+    parser.add_argument(
+        "--spotify-where",
+        type=parse_spotify_where,
+        help="Filter expression over track fields, e.g. 'duration_seconds < 300'",
+    )
 
     # twitter
     parser.add_argument(
@@ -40,6 +86,11 @@ def get_parsed_args() -> Namespace:
     parser.add_argument(
         "--twitter-replies", action="store_true", help="Include replies"
     )
+    parser.add_argument(
+        "--twitter-where",
+        type=parse_twitter_where,
+        help="Filter expression over tweet fields, e.g. 'likes > 50 and not retweet'",
+    )
 
     # general
     CHOICES = ["reddit", "spotify", "twitter"]
@@ -57,4 +108,21 @@ def get_parsed_args() -> Namespace:
         help="List of integrations to exclude",
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--profiles",
+        type=Path,
+        help="Directory of profile `.env` files to run in a single process",
+    )
+
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Seconds after which results fetched so far are rendered",
+    )
+
+    parsed_args = parser.parse_args()
+    parsed_args.deadline_at = (
+        time.monotonic() + parsed_args.deadline if parsed_args.deadline else None
+    )
+
+    return parsed_args
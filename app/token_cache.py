@@ -0,0 +1,75 @@
+import json
+import time
+from threading import Lock, Timer
+from typing import Callable
+
+from app.lib import CACHE_DIR, write_json_atomic
+
+TOKEN_CACHE_PATH = CACHE_DIR / "tokens.json"
+# tokens are refreshed this many seconds before they expire
+TOKEN_EXPIRY_MARGIN = 60
+# failed background refreshes are retried after this many seconds
+TOKEN_REFRESH_RETRY_DELAY = 30
+
+_token_cache_lock = Lock()
+
+
+def _read_tokens() -> dict[str, dict]:
+    """Returns map of keys to cached token infos or an empty map if the cache file is missing or corrupt"""
+
+    try:
+        return json.loads(TOKEN_CACHE_PATH.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def get_cached_token(key: str) -> dict | None:
+    """Returns cached token info stored under `key` or None if missing"""
+
+    with _token_cache_lock:
+        return _read_tokens().get(key)
+
+
+def save_token(key: str, token_info: dict) -> None:
+    """Stores token info under `key` in the token cache file readable by the current user only"""
+
+    with _token_cache_lock:
+        tokens = _read_tokens()
+        tokens[key] = token_info
+
+        write_json_atomic(TOKEN_CACHE_PATH, tokens, mode=0o600)
+
+
+def is_token_expiring(token_info: dict) -> bool:
+    """Returns whether token expires within `TOKEN_EXPIRY_MARGIN`"""
+    return token_info["expires_at"] - time.time() < TOKEN_EXPIRY_MARGIN
+
+
+def schedule_token_refresh(refresh_fn: Callable[[], dict], expires_at: float) -> None:
+    """Runs `refresh_fn` in the background shortly before `expires_at` and again before each refreshed token expires
+
+    `refresh_fn` must return the refreshed token info with an `expires_at` timestamp.
+    """
+
+    def refresh() -> None:
+        """Refreshes the token and schedules the next refresh, retrying after `TOKEN_REFRESH_RETRY_DELAY` on errors"""
+
+        try:
+            token_info = refresh_fn()
+        except Exception:
+            # e.g. a network error, the current token is usually still valid for a while
+            _start_timer(TOKEN_REFRESH_RETRY_DELAY, refresh)
+            return
+
+        schedule_token_refresh(refresh_fn, token_info["expires_at"])
+
+    _start_timer(max(expires_at - TOKEN_EXPIRY_MARGIN - time.time(), 0), refresh)
+
+
+def _start_timer(interval: float, function: Callable[[], None]) -> None:
+    """Runs `function` in the background after `interval` seconds"""
+
+    # daemon timer, so a pending refresh never keeps the process alive
+    timer = Timer(interval, function)
+    timer.daemon = True
+    timer.start()
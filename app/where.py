@@ -0,0 +1,244 @@
+import ast
+import operator
+from argparse import ArgumentTypeError
+from typing import Any, Callable, Iterable
+
+COMPARE_OPERATORS: dict[type, Callable[[Any, Any], bool]] = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda left, right: left in right,
+    ast.NotIn: lambda left, right: left not in right,
+}
+ALLOWED_NODES = (
+    ast.Expression,
+    ast.BoolOp,
+    ast.And,
+    ast.Or,
+    ast.UnaryOp,
+    ast.Not,
+    ast.USub,
+    ast.Compare,
+    ast.Name,
+    ast.Load,
+    ast.Constant,
+    ast.List,
+    ast.Tuple,
+    *COMPARE_OPERATORS.keys(),
+)
+
+
+class _NegativeNumberFolder(ast.NodeTransformer):
+    """Replaces negated number literals with negative number constants"""
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> ast.AST:
+        """Returns negative number constant for a negated number literal, the node itself otherwise"""
+
+        self.generic_visit(node)
+
+        if isinstance(node.op, ast.USub) and _is_number(node.operand):
+            return ast.copy_location(ast.Constant(-node.operand.value), node)  # type: ignore[attr-defined]
+
+        return node
+
+
+def parse_where(expression: str, fields: Iterable[str]) -> ast.Expression:
+    """Returns syntax tree of a `--*-where` filter expression over `fields`
+
+    Expressions are made of field names, string and number literals, lists, comparisons, `and`, `or` and `not`,
+    e.g. `ups > 100 and flair != "Meta"`. Strings are compared case-insensitively.
+    """
+
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as error:
+        raise ArgumentTypeError(f"invalid filter expression: {error.msg}")
+
+    for node in ast.walk(tree):
+        # `-` is only supported as the sign of a number literal
+        if not isinstance(node, ALLOWED_NODES) or (
+            isinstance(node, ast.UnaryOp)
+            and isinstance(node.op, ast.USub)
+            and not _is_number(node.operand)
+        ):
+            raise ArgumentTypeError(
+                f"unsupported syntax in filter expression: {ast.get_source_segment(expression, node) or type(node).__name__}"
+            )
+
+        if isinstance(node, ast.Name) and node.id not in fields:
+            raise ArgumentTypeError(
+                f"unknown filter field `{node.id}`, expected one of: {', '.join(fields)}"
+            )
+
+    return _NegativeNumberFolder().visit(tree)
+
+
+def _casefold(value: Any) -> Any:
+    """Returns `value` casefolded if it is a string or a list of strings, unchanged otherwise"""
+
+    if isinstance(value, str):
+        return value.casefold()
+
+    if isinstance(value, list):
+        return [_casefold(element) for element in value]
+
+    return value
+
+
+def _compile_node(
+    node: ast.AST, fields: dict[str, Callable[[dict], Any]]
+) -> Callable[[dict], Any]:
+    """Returns getter evaluating the filter expression node against an item"""
+
+    if isinstance(node, ast.BoolOp):
+        operands = [_compile_node(value, fields) for value in node.values]
+
+        if isinstance(node.op, ast.And):
+            return lambda item: all(operand(item) for operand in operands)
+
+        return lambda item: any(operand(item) for operand in operands)
+
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile_node(node.operand, fields)
+        return lambda item: not operand(item)
+
+    if isinstance(node, ast.Compare):
+        left = _compile_node(node.left, fields)
+        comparisons = [
+            (COMPARE_OPERATORS[type(op)], _compile_node(comparator, fields))
+            for op, comparator in zip(node.ops, node.comparators)
+        ]
+
+        def compare(item: dict) -> bool:
+            """Returns whether all chained comparisons hold for the item"""
+
+            left_value = left(item)
+
+            for compare_values, right in comparisons:
+                right_value = right(item)
+
+                # e.g. missing flair compared to a number never matches
+                try:
+                    if not compare_values(left_value, right_value):
+                        return False
+                except TypeError:
+                    return False
+
+                left_value = right_value
+
+            return True
+
+        return compare
+
+    if isinstance(node, ast.Name):
+        getter = fields[node.id]
+        return lambda item: _casefold(getter(item))
+
+    if isinstance(node, (ast.List, ast.Tuple)):
+        elements = [_compile_node(element, fields) for element in node.elts]
+        return lambda item: [element(item) for element in elements]
+
+    value = _casefold(node.value)  # type: ignore[attr-defined]
+    return lambda item: value
+
+
+def compile_where(
+    tree: ast.Expression | None, fields: dict[str, Callable[[dict], Any]]
+) -> Callable[[dict], bool]:
+    """Returns predicate of the filter expression evaluated against items by `fields` getters, matching all items if omitted"""
+
+    if tree is None:
+        return lambda item: True
+
+    predicate = _compile_node(tree.body, fields)
+
+    return lambda item: bool(predicate(item))
+
+
+def get_conjuncts(tree: ast.Expression | None) -> list[ast.expr]:
+    """Returns list of top level `and` terms of the filter expression, all of which must match"""
+
+    if tree is None:
+        return []
+
+    conjuncts = []
+    nodes = [tree.body]
+    while nodes:
+        node = nodes.pop(0)
+
+        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+            nodes = node.values + nodes
+            continue
+
+        conjuncts.append(node)
+
+    return conjuncts
+
+
+def references_field(tree: ast.Expression | None, field: str) -> bool:
+    """Returns whether the filter expression uses the field"""
+
+    if tree is None:
+        return False
+
+    return any(
+        isinstance(node, ast.Name) and node.id == field for node in ast.walk(tree)
+    )
+
+
+def get_bool_pushdown(tree: ast.Expression | None, field: str) -> bool | None:
+    """Returns value the boolean field is required to have by the filter expression or None if not required"""
+
+    for conjunct in get_conjuncts(tree):
+        if isinstance(conjunct, ast.Name) and conjunct.id == field:
+            return True
+
+        if (
+            isinstance(conjunct, ast.UnaryOp)
+            and isinstance(conjunct.op, ast.Not)
+            and isinstance(conjunct.operand, ast.Name)
+            and conjunct.operand.id == field
+        ):
+            return False
+
+    return None
+
+
+def _is_field(node: ast.expr, field: str) -> bool:
+    """Returns whether the node is the field name"""
+    return isinstance(node, ast.Name) and node.id == field
+
+
+def _is_number(node: ast.expr) -> bool:
+    """Returns whether the node is a number literal"""
+    return (
+        isinstance(node, ast.Constant)
+        and isinstance(node.value, (int, float))
+        and not isinstance(node.value, bool)
+    )
+
+
+def get_upper_bound(tree: ast.Expression | None, field: str) -> float | None:
+    """Returns the lowest upper bound the filter expression requires of the numeric field or None if not bounded"""
+
+    bounds = []
+    for conjunct in get_conjuncts(tree):
+        if not (isinstance(conjunct, ast.Compare) and len(conjunct.ops) == 1):
+            continue
+
+        left, op, right = conjunct.left, conjunct.ops[0], conjunct.comparators[0]
+
+        if _is_field(left, field) and isinstance(op, (ast.Lt, ast.LtE)):
+            bound = right
+        elif _is_field(right, field) and isinstance(op, (ast.Gt, ast.GtE)):
+            bound = left
+        else:
+            continue
+
+        if _is_number(bound):
+            bounds.append(bound.value)  # type: ignore[attr-defined]
+
+    return min(bounds, default=None)
@@ -1,28 +1,98 @@
 import json
-import os
+import sys
 from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-from dotenv import load_dotenv
+from rich.console import Console
 
-from app.lib import build_integration_function_map, get_integration_render_functions
+from app.lib import (
+    build_integration_function_map,
+    get_config,
+    get_integration_render_functions,
+)
 from app.parser import get_parsed_args
 
-load_dotenv()
+MAX_PROFILE_WORKERS = 8
 
-ENABLED_INTEGRATIONS: list[str] = json.loads(os.getenv("ENABLED_INTEGRATIONS"))
-ARGS: Namespace = get_parsed_args()
 
+def run_profile(
+    config: dict[str, str | None], parsed_args: Namespace, console: Console
+) -> None:
+    """Runs enabled integrations of a single profile"""
+
+    enabled_integrations: list[str] = json.loads(config["ENABLED_INTEGRATIONS"])
 
-def main():
     integration_function_map = build_integration_function_map(
-        enabled_integrations=ENABLED_INTEGRATIONS
+        enabled_integrations=enabled_integrations
     )
     integration_functions_to_run = get_integration_render_functions(
-        function_map=integration_function_map, parsed_args=ARGS
+        function_map=integration_function_map, parsed_args=parsed_args
     )
 
     for fn in integration_functions_to_run:
-        fn()
+        fn(config=config, parsed_args=parsed_args, console=console)
+
+
+def run_profile_to_file(env_path: Path, parsed_args: Namespace) -> Path:
+    """Runs a single profile and writes its output next to the profile `.env` file"""
+
+    output_path = env_path.with_suffix(".log")
+
+    with output_path.open("w") as output_file:
+        console = Console(file=output_file)
+
+        try:
+            run_profile(
+                config=get_config(env_path), parsed_args=parsed_args, console=console
+            )
+        except Exception:
+            console.print_exception()
+            raise
+
+    return output_path
+
+
+def run_profiles(profiles_dir: Path, parsed_args: Namespace) -> bool:
+    """Runs all profiles found in `profiles_dir` concurrently and returns whether all of them succeeded"""
+
+    console = Console()
+    env_paths = sorted(profiles_dir.glob("*.env"))
+
+    if not env_paths:
+        console.print(f"[red bold]No profiles found in {profiles_dir}[/red bold]")
+        return False
+
+    with ThreadPoolExecutor(
+        max_workers=min(len(env_paths), MAX_PROFILE_WORKERS)
+    ) as executor:
+        futures = {
+            env_path: executor.submit(run_profile_to_file, env_path, parsed_args)
+            for env_path in env_paths
+        }
+
+    succeeded = True
+    for env_path, future in futures.items():
+        if future.exception():
+            console.print(f"[red]✘[/red] {env_path.stem} failed: {future.exception()}")
+            succeeded = False
+        else:
+            console.print(f"[green]✔[/green] {env_path.stem} → {future.result()}")
+
+    return succeeded
+
+
+def main():
+    # parsed here rather than on import, render pool workers import this module
+    parsed_args = get_parsed_args()
+
+    if parsed_args.profiles:
+        # a non-zero exit status lets schedulers notice failed profiles
+        if not run_profiles(parsed_args.profiles, parsed_args):
+            sys.exit(1)
+        return
+
+    run_profile(config=get_config(), parsed_args=parsed_args, console=Console())
 
 
 if __name__ == "__main__":